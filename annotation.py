@@ -1,14 +1,18 @@
 
 
-from dataclasses import dataclass, field
-from typing import Optional, Dict, Any
-from .elasticsearch_backend import es_store, es_find_fbi_annotations, annotated_fbi_record
-import fbi_core
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Iterable, List
+from .elasticsearch_backend import store, store_many, es_find_fbi_annotations, es_find_fbi_annotations_bulk, es_find_fbi_annotations_cached
+from .fbi_record import AnnotationContext, FBIRecord, get_raw_record, get_raw_records, get_record
+from .scope import after_matches, before_matches, is_under, larger_matches, smaller_matches
+from .merge import merge_annotations
 
 
-@dataclass
+@dataclass(frozen=True)
 class AppliesTo:
-    """Defines the criteria for applying an annotation to a file."""
+    """Defines the criteria for applying an annotation to a file. Frozen, as the predicates used
+    by matches are built from the criteria once; use dataclasses.replace to change them."""
     path: Optional[str] = None
     under: Optional[str] = None
     ext: Optional[str] = None
@@ -17,53 +21,74 @@ class AppliesTo:
     before_regex_date: Optional[str] = None
     after_regex_date: Optional[str] = None
 
-    def matches(self, context: 'AnnotationContext') -> bool:
-        if self.path and self.path != context.path:
-            return False
-        if self.under and not context.path.startswith(self.under):
-            return False
-        if self.ext and not context.path.endswith(self.ext):
+    def __post_init__(self):
+        """Build the list of predicates for the criteria that are set, so matching a file only
+        runs the checks that apply. Dates are parsed here once rather than on every match.
+        The predicates are a plain attribute rather than a field so asdict does not include them."""
+        preds: List[Callable[['AnnotationContext'], bool]] = []
+        if self.path:
+            preds.append(lambda c, p=self.path: c.path == p)
+        if self.under:
+            preds.append(lambda c, u=self.under: is_under(c.path, u))
+        if self.ext:
+            preds.append(lambda c, e=self.ext: c.path.endswith(e))
+        if self.larger is not None:
+            preds.append(lambda c, n=self.larger: larger_matches(c.size, n))
+        if self.smaller is not None:
+            preds.append(lambda c, n=self.smaller: smaller_matches(c.size, n))
+        if self.before_regex_date or self.after_regex_date:
+            before = datetime.fromisoformat(self.before_regex_date) if self.before_regex_date else None
+            after = datetime.fromisoformat(self.after_regex_date) if self.after_regex_date else None
+            preds.append(lambda c, b=before, a=after: self._date_matches(c._extract_date(), b, a))
+        object.__setattr__(self, "_preds", preds)
+
+    @staticmethod
+    def _date_matches(file_date: Optional[datetime], before: Optional[datetime], after: Optional[datetime]) -> bool:
+        if not file_date:
             return False
-        if self.type and self.type != context.type:
+        if before and not before_matches(file_date, before):
             return False
-        if self.larger is not None and context.size <= self.larger:
+        if after and not after_matches(file_date, after):
             return False
-        if self.smaller is not None and context.size >= self.smaller:
-            return False
-
-        file_date = context._extract_date()
-        if self.before_regex_date:
-            target = datetime.fromisoformat(self.before_regex_date)
-            if not file_date or file_date >= target:
-                return False
-        if self.after_regex_date:
-            target = datetime.fromisoformat(self.after_regex_date)
-            if not file_date or file_date <= target:
-                return False
-
         return True
 
+    def matches(self, context: 'AnnotationContext') -> bool:
+        return all(p(context) for p in self._preds)
+
 
 @dataclass
 class FBIAnnotation:
-    id: Optional[str] = None
     applies_to: AppliesTo
     annotation: Dict[str, Any]
     merge_strategy: str
     metadata: Optional[Dict[str, Any]] = field(default_factory=dict)
+    id: Optional[str] = None
 
 
-    def save(self) -> None:
-        """Save the annotation to Elasticsearch."""
-        data = {
-            "applies_to": self.applies_to,
+    def to_dict(self) -> Dict[str, Any]:
+        """Document stored in Elasticsearch for this annotation. applies_to may be an AppliesTo or
+        a plain dict; criteria that are not set are left out."""
+        if isinstance(self.applies_to, AppliesTo):
+            applies_to = {k: v for k, v in asdict(self.applies_to).items() if v is not None}
+        else:
+            applies_to = dict(self.applies_to)
+        return {
+            "applies_to": applies_to,
             "annotation": self.annotation,
             "merge_strategy": self.merge_strategy,
-            "metadata": self.metadata
+            "metadata": dict(self.metadata or {})
         }
-        store(data)
+
+    def save(self) -> None:
+        """Save the annotation to Elasticsearch."""
+        store(self.to_dict())
         print("Annotation saved successfully.")
 
+    @classmethod
+    def save_many(cls, annotations: Iterable['FBIAnnotation'], chunk_size: int = 500, thread_count: int = 4) -> None:
+        """Save many annotations to Elasticsearch using parallel bulk requests."""
+        store_many((a.to_dict() for a in annotations), chunk_size=chunk_size, thread_count=thread_count)
+
     def delete(self) -> None:
         """Delete the annotation from Elasticsearch."""
         # Assuming we have a method to delete by applies_to criteria
@@ -71,49 +96,6 @@ class FBIAnnotation:
         print("Annotation deleted successfully.")
 
 
-# Sample annotations
-a = FBIAnnotation(
-    applies_to={"ext": ".nc"},
-    annotation={"format": "NetCDF-4"},
-    merge_strategy="default",
-    metadata={"created_by": "scanner"}
-    )
-
-b = FBIAnnotation(    
-    applies_to={"path": "/data/cmip5"},
-    annotation={"storage_plan": "tape only"},
-    merge_strategy="override",
-    metadata={"created_by": "SJP"}
-    )
-
-c = FBIAnnotation(
-    applies_to={"under": "/data", "smaller": 1000},
-    annotation={"note": "tiny file"},
-    merge_strategy="addition"
-    )
-
-d = FBIAnnotation(
-    applies_to={"under": "/data", "smaller": 1000000000},
-    annotation={"note": "not huge"},
-    merge_strategy="addition"
-    )
-
-e = FBIAnnotation(
-    applies_to={"ext": ".txt"},
-    annotation={"format": "Text"},
-    merge_strategy="default",
-    metadata={"created_by": "scanner"}
-    )
-
-
-# save to elasticsearch
-a.save()
-b.save()
-...
-
-
-find_fbi_annotations(applies_under="/data", applies_ext=".zip", annotation_keys=["storage_plan"])
-
 # use fbi to make context
 def find_annotations_from_fbi_path(path):
     """Find annotations for a given file path in the FBI."""
@@ -133,54 +115,30 @@ def find_annotations_from_fbi_path(path):
     # - {"under": "/data", "smaller": 1000000000} -> {"note": "not huge"}
 
     # look up fbi recor
-    record = fbi_core.get_record(path)
+    record = get_record(path)
     # use the record as context for the annotation search
-    annotations = es_find_fbi_annotations_records(
-        path=record["path"],
-        under=record.directory,
-        name=record.name,
-        size=record.size,
-        item_type=record.item_type,
-        last_modified=record.last_modified
-    )
-    #returnlist of annotations
-
-def merge_annotations(annotations):
-    """Merge annotations based on their merge strategy."""
-    merged = {}
-    annotations.sort()
-    for annotation in annotations:
-        merged.update(annotation)
-    return merged
+    return list(es_find_fbi_annotations(record))
 
-    
 def annotated_fbi_record(path):
     """Get an annotated FBI record for a given path."""
     # Get the FBI record
-    record = fbi_core.get_record(path)
+    raw_record = get_raw_record(path)
+    record = FBIRecord.from_dict(raw_record)
     
     # Find annotations for the record
-    annotations = es_find_fbi_annotations(record)
+    annotations = es_find_fbi_annotations_cached(record)
     
     # Merge annotations into the record
     merged_annotations = merge_annotations(annotations)
     
     # Add annotations to the record
-    record.update(merged_annotations)
-    
-    return record
-
-
-find_annotations_from_fbi_summary("/data/xxxx")
-#
-# summary for /data/xxxx
-# exts = .nc .txt .gif
-# min size = 34040
-# max size = 34983493248
-# ...
-#
-# Result: 
-# - {"ext": ".nc"} -> {"format": "NetCDF-4"}
-# - {"under": "/data", "smaller": 1000000000} -> {"note": "not huge"}
-# - {"ext": ".txt"} -> {"format": "Text"}
-```
\ No newline at end of file
+    return {**raw_record, **merged_annotations}
+
+
+def annotated_fbi_records(paths):
+    """Get annotated FBI records for many paths, fetching the records in one request and looking
+    up their annotations in another."""
+    raw_records = get_raw_records(paths)
+    records = [FBIRecord.from_dict(raw_record) for raw_record in raw_records]
+    return [{**raw_record, **merge_annotations(annotations)}
+            for raw_record, annotations in zip(raw_records, es_find_fbi_annotations_bulk(records))]
@@ -0,0 +1,90 @@
+"""asyncio versions of the Elasticsearch annotation lookups, so many lookups can be in flight at once"""
+
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+import fbi_core
+
+from .elasticsearch_backend import (INDEXNAME, PAGE_SIZE, PIT_KEEP_ALIVE, ANNOTATION_SOURCE_FIELDS,
+                                    ORJSONSerializer, build_query, get_client, hits_to_annotations,
+                                    load_config, pit_search_kwargs, search_kwargs)
+from .fbi_record import FBIRecord, get_raw_record, get_raw_records
+from .merge import merge_annotations
+
+# maximum number of annotation lookups in flight at once, to avoid overloading the search thread pool.
+MAX_IN_FLIGHT = 64
+
+
+def async_client() -> AsyncElasticsearch:
+    """New async Elasticsearch client. Use it as an async context manager so it is closed in the
+    event loop that used it. It connects to the same nodes as get_client, with their full node
+    configs so TLS settings such as ca_certs are kept, and uses the same api key and serializer."""
+    hosts = [node.config for node in get_client().transport.node_pool.all()]
+    return AsyncElasticsearch(hosts=hosts, api_key=load_config()["ES"]["api_key"],
+                              serializer=ORJSONSerializer())
+
+
+async def search_all_async(es: AsyncElasticsearch, query: Dict[str, Any],
+                           source_fields: List[str]) -> List[Dict[str, Any]]:
+    """All annotations matching query. See search_all."""
+    result = await es.search(**search_kwargs(query, source_fields))
+    if len(result["hits"]["hits"]) < PAGE_SIZE:
+        return hits_to_annotations(result)
+
+    results = []
+    pit_id = (await es.open_point_in_time(index=INDEXNAME, keep_alive=PIT_KEEP_ALIVE))["id"]
+    try:
+        search_after = None
+        while True:
+            result = await es.search(**pit_search_kwargs(query, source_fields, pit_id, search_after))
+            pit_id = result.get("pit_id", pit_id)
+            hits = result["hits"]["hits"]
+            results.extend(hits_to_annotations(result))
+            if len(hits) < PAGE_SIZE:
+                break
+            search_after = hits[-1]["sort"]
+    finally:
+        await es.close_point_in_time(id=pit_id)
+    return results
+
+
+async def es_find_fbi_annotations_async(record: FBIRecord, es: Optional[AsyncElasticsearch] = None,
+                                        source_fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Find annotations for a given FBI record. See es_find_fbi_annotations. If no client is given
+    one is made and closed for this lookup."""
+    if es is None:
+        async with async_client() as es:
+            return await es_find_fbi_annotations_async(record, es, source_fields)
+    return await search_all_async(es, build_query(record), source_fields or ANNOTATION_SOURCE_FIELDS)
+
+
+async def fetch_raw_records(paths: List[str], semaphore: asyncio.Semaphore) -> List[Dict[str, Any]]:
+    """fbi_core records for many paths. One bulk lookup is used when fbi_core has one; otherwise
+    the per-path lookups run concurrently in worker threads."""
+    if hasattr(fbi_core, "get_records"):
+        return await asyncio.to_thread(get_raw_records, paths)
+
+    async def fetch(path):
+        async with semaphore:
+            return await asyncio.to_thread(get_raw_record, path)
+
+    return await asyncio.gather(*[fetch(path) for path in paths])
+
+
+async def annotated_fbi_records_async(paths: List[str]) -> List[Dict[str, Any]]:
+    """Get annotated FBI records for many paths. The records are fetched first and then the
+    annotation lookups are run concurrently."""
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async with async_client() as es:
+        async def find_annotations(record):
+            async with semaphore:
+                return await es_find_fbi_annotations_async(record, es)
+
+        raw_records = await fetch_raw_records(paths, semaphore)
+        records = [FBIRecord.from_dict(raw_record) for raw_record in raw_records]
+        results = await asyncio.gather(*[find_annotations(record) for record in records])
+    return [{**raw_record, **merge_annotations(annotations)}
+            for raw_record, annotations in zip(raw_records, results)]
@@ -1,36 +1,131 @@
 """functions to store and retrieve data from an Elasticsearch index"""
 
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from ceda_es_client import CEDAElasticsearchClient
+from elasticsearch.helpers import bulk, parallel_bulk, scan
+from elasticsearch.serializer import JSONSerializer
+import orjson
 import yaml
 import os
 import datetime
+import functools
+import time
 
-#load api key  
-api_key = yaml.load(open(os.environ["HOME"] + "/.fbi.yml"), Loader=yaml.Loader)["ES"]["api_key"]
-ES = CEDAElasticsearchClient(api_key=api_key)
+from .fbi_record import FBIRecord
+from .scope import (age_in_days, ancestor_paths, annotation_applies, direct_children_regexp, size_bucket,
+                    size_bucket_bounds, size_bucket_limit, size_bucket_matches)
+
+
+class ORJSONSerializer(JSONSerializer):
+    """Serialize request bodies with orjson, which is much faster than json for the query dicts built here."""
+    def dumps(self, data: Any) -> bytes:
+        if isinstance(data, str):
+            return data.encode("utf-8")
+        if isinstance(data, bytes):
+            return data
+        return orjson.dumps(data, default=self.default)
+
+
+@functools.lru_cache(maxsize=None)
+def load_config() -> Dict[str, Any]:
+    """Configuration loaded from ~/.fbi.yml."""
+    with open(os.environ["HOME"] + "/.fbi.yml") as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+def get_client() -> CEDAElasticsearchClient:
+    """Elasticsearch client for this process. Clients are cached by process id, so a worker forked
+    after the parent made its client still creates its own. The api key is loaded from ~/.fbi.yml."""
+    return client_for_process(os.getpid())
+
+
+@functools.lru_cache(maxsize=None)
+def client_for_process(pid: int) -> CEDAElasticsearchClient:
+    """Elasticsearch client for the process pid; see get_client."""
+    api_key = load_config()["ES"]["api_key"]
+    return CEDAElasticsearchClient(api_key=api_key, serializer=ORJSONSerializer())
 
 
 INDEXNAME = "fbi-annotations"
 
+# applies_to fields that restrict the scope of an annotation. When one of these is not set on an
+# annotation a matching applies_to.<field>_unset flag is indexed so that "no restriction" can be
+# queried with a term filter rather than a must_not exists.
+APPLIES_TO_FIELDS = ("path", "ext", "under", "smaller", "larger", "before_regex_date",
+                     "after_regex_date", "younger_regex_date", "older_regex_date")
+
+# fields prepare_document adds to applies_to and metadata for searching on. They are not part of
+# the annotation and are removed from search results.
+INDEX_ONLY_FIELDS = {
+    "applies_to": frozenset([f"{name}_unset" for name in APPLIES_TO_FIELDS] + ["size_bucket_matches"]),
+    "metadata": frozenset(["has_expiry"]),
+}
+
+# number of annotations fetched per search request and how long a point in time is kept open
+# between pages.
+PAGE_SIZE = 1000
+PIT_KEEP_ALIVE = "1m"
+
+# seconds a cached annotation lookup is reused for.
+CACHE_TTL = 300
+
+# searches use the shard request cache and a fixed preference so that repeated searches go to the
+# same shard copies and can be answered from their caches.
+SEARCH_PREFERENCE = "fbi-annotations"
+
+# fields of an annotation document returned by searches.
+ANNOTATION_SOURCE_FIELDS = ["applies_to", "annotation", "merge_strategy", "metadata.expires"]
+
 
 INDEX_SETTINGS ={
   "settings": {
-      "index":{"number_of_shards" : "1", "number_of_replicas" : "1"},
+      "index":{"number_of_shards" : "1", "number_of_replicas" : "1", "requests.cache.enable": True},
     "analysis": {
       "analyzer": {"path_analyzer": {"tokenizer": "cedaa_tokenizer"}},
       "tokenizer": {"cedaa_tokenizer": {"type": "path_hierarchy"}}
     }
   },
-  "mappings": {"properties": {
+  "mappings": {"dynamic": "strict", "properties": {
       "directory": {
         "type": "text", "fields": {
           "tree": {"type": "text", "analyzer": "path_analyzer"},
           "analyzed": {"type": "text"}
         }
-      }
+      },
+      "applies_to": {"type": "object", "properties": {
+          "path": {"type": "keyword"},
+          "under": {"type": "keyword"},
+          "ext": {"type": "keyword"},
+          "smaller": {"type": "long"},
+          "size_bucket_matches": {"type": "keyword"},
+          "larger": {"type": "long"},
+          "younger_regex_date": {"type": "long"},
+          "older_regex_date": {"type": "long"},
+          "before_regex_date": {"type": "date"},
+          "after_regex_date": {"type": "date"},
+          # documented in fbi-annotation-design.md but not yet used in searches.
+          "item_type": {"type": "keyword"},
+          "type": {"type": "keyword"},
+          "before_mod_date": {"type": "date"},
+          "after_mod_date": {"type": "date"},
+          "younger_mod_date": {"type": "long"},
+          "older_mod_date": {"type": "long"},
+          "filename_regex": {"type": "keyword"},
+          **{f"{name}_unset": {"type": "boolean"} for name in APPLIES_TO_FIELDS}
+        }
+      },
+      # annotation and metadata are only returned, never searched, so are not indexed. The
+      # exception is metadata.expires and metadata.has_expiry which are used to filter out expired
+      # annotations.
+      "annotation": {"type": "object", "enabled": False},
+      "metadata": {"type": "object", "dynamic": False, "properties": {
+          "expires": {"type": "date"},
+          "has_expiry": {"type": "boolean"}
+        }
+      },
+      "merge_strategy": {"type": "keyword"}
     }}
 }
 
@@ -43,77 +138,315 @@ def create_index(es: CEDAElasticsearchClient) -> None:
     else:
         print(f"Index '{INDEXNAME}' already exists.")
 
+def add_unset_flags(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of data with applies_to.<field>_unset flags for every scope field the annotation does
+    not restrict."""
+    applies_to = dict(data.get("applies_to") or {})
+    for name in APPLIES_TO_FIELDS:
+        if applies_to.get(name) is None:
+            applies_to[f"{name}_unset"] = True
+    return {**data, "applies_to": applies_to}
+
+
+def prepare_document(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Get an annotation ready for indexing. applies_to.under is stored without a trailing slash
+    so that it can be matched exactly against the record ancestors listed by ancestor_paths, and
+    metadata.has_expiry is set so unexpired annotations can be found with term and range filters.
+    applies_to.size_bucket_matches lists the size buckets that are entirely within applies_to.smaller.
+    The caller's data is not changed; a new document is returned."""
+    applies_to = dict(data.get("applies_to") or {})
+    if applies_to.get("under"):
+        applies_to["under"] = applies_to["under"].rstrip("/") or "/"
+    if applies_to.get("smaller") is not None:
+        applies_to["size_bucket_matches"] = size_bucket_matches(applies_to["smaller"])
+    metadata = dict(data.get("metadata") or {})
+    metadata["has_expiry"] = metadata.get("expires") is not None
+    return add_unset_flags({**data, "applies_to": applies_to, "metadata": metadata})
+
+
+def strip_index_fields(source: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of an annotation document without the INDEX_ONLY_FIELDS prepare_document added."""
+    stripped = dict(source)
+    for key, index_only in INDEX_ONLY_FIELDS.items():
+        if isinstance(stripped.get(key), dict):
+            stripped[key] = {k: v for k, v in stripped[key].items() if k not in index_only}
+    return stripped
+
+
 def store(data: Dict[str, Any]) -> None:
     """Store data in the Elasticsearch index."""
     try:
-        ES.index(index=INDEXNAME, body=data)
+        get_client().index(index=INDEXNAME, body=prepare_document(data))
+        refresh_cache()
         print(f"Data stored successfully in index '{INDEXNAME}'.")
     except Exception as e:
         print(f"Error storing data: {e}")   
 
 
+def get_refresh_interval(es: CEDAElasticsearchClient) -> Optional[str]:
+    """The refresh interval set on the index, or None if it uses the cluster default."""
+    settings = es.indices.get_settings(index=INDEXNAME, name="index.refresh_interval")
+    index_settings = next(iter(settings.values()), {}).get("settings", {})
+    return index_settings.get("index", {}).get("refresh_interval")
+
+
+def store_many(data_list: Iterable[Dict[str, Any]], chunk_size: int = 500, thread_count: int = 4) -> None:
+    """Store many documents in the Elasticsearch index using parallel bulk requests.
+    Index refresh is switched off while loading and the index's own refresh interval, or the
+    default if it has none, is put back afterwards."""
+    es = get_client()
+    actions = ({"_index": INDEXNAME, "_source": prepare_document(data)} for data in data_list)
+    refresh_interval = get_refresh_interval(es)
+    es.indices.put_settings(index=INDEXNAME, body={"index": {"refresh_interval": "-1"}})
+    try:
+        stored = 0
+        for ok, item in parallel_bulk(es, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                      queue_size=thread_count, raise_on_error=False):
+            if ok:
+                stored += 1
+            else:
+                print(f"Error storing data: {item}")
+        print(f"{stored} documents stored successfully in index '{INDEXNAME}'.")
+    finally:
+        es.indices.put_settings(index=INDEXNAME, body={"index": {"refresh_interval": refresh_interval}})
+        refresh_cache()
+
+
+def reindex_annotations(old_index: str) -> None:
+    """Copy the annotations in old_index into INDEXNAME, passing each one through prepare_document.
+    Annotations stored before the applies_to.<field>_unset flags were added only match records
+    when every scope field is set, so existing annotations must be moved into an index created
+    from the current INDEX_SETTINGS with this, e.g. after copying them to a backup index with
+    the _reindex API and deleting INDEXNAME."""
+    es = get_client()
+    create_index(es)
+    actions = ({"_index": INDEXNAME, "_id": hit["_id"],
+                "_source": prepare_document(strip_index_fields(hit["_source"]))}
+               for hit in scan(es, index=old_index))
+    stored, errors = bulk(es, actions, raise_on_error=False)
+    for error in errors:
+        print(f"Error storing data: {error}")
+    print(f"{stored} documents copied from '{old_index}' to '{INDEXNAME}'.")
+    refresh_cache()
+
 
-def es_find_fbi_annotations(record: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Find annotations for a given FBI record. 
+def scope_clause(name: str, match: Dict[str, Any]) -> Dict[str, Any]:
+    """Clause matching annotations where applies_to.<name> matches or is not set."""
+    return {"bool": {"should": [match, {"term": {f"applies_to.{name}_unset": True}}],
+                     "minimum_should_match": 1}}
+
+
+def path_clauses(path: str) -> List[Dict[str, Any]]:
+    """Clauses for the exact applies_to.path scope."""
+    return [scope_clause("path", {"term": {"applies_to.path": path}})]
+
+
+def under_clauses(path: str) -> List[Dict[str, Any]]:
+    """Clauses for the applies_to.under scope. All the ancestors of path are matched with a single
+    terms filter against the applies_to.under keyword."""
+    return [scope_clause("under", {"terms": {"applies_to.under": ancestor_paths(path)}})]
+
+
+def ext_clauses(ext: str) -> List[Dict[str, Any]]:
+    """Clauses for the applies_to.ext scope."""
+    return [scope_clause("ext", {"term": {"applies_to.ext": ext}})]
+
+
+def size_clauses(size: int) -> List[Dict[str, Any]]:
+    """Clauses for the applies_to.smaller and applies_to.larger scopes, see smaller_matches and
+    larger_matches. Annotations whose smaller limit covers the whole size bucket match on the
+    bucket tag, so the range only has to find limits between size and the top of its bucket."""
+    limit = size_bucket_limit(size)
+    if limit is None:
+        smaller = {"range": {"applies_to.smaller": {"gt": size}}}
+    else:
+        smaller = {"bool": {"should": [{"term": {"applies_to.size_bucket_matches": f"lt_{limit}"}},
+                                       {"range": {"applies_to.smaller": {"gt": size, "lt": limit}}}]}}
+    return [scope_clause("smaller", smaller),
+            scope_clause("larger", {"range": {"applies_to.larger": {"lt": size}}})]
+
+
+def regex_date_clauses(regex_date: str) -> List[Dict[str, Any]]:
+    """Clauses for the regex date scopes, see before_matches, after_matches, younger_matches and
+    older_matches."""
+    age = age_in_days(regex_date)
+    return [scope_clause("before_regex_date", {"range": {"applies_to.before_regex_date": {"gt": regex_date}}}),
+            scope_clause("after_regex_date", {"range": {"applies_to.after_regex_date": {"lt": regex_date}}}),
+            scope_clause("younger_regex_date", {"range": {"applies_to.younger_regex_date": {"gt": age}}}),
+            scope_clause("older_regex_date", {"range": {"applies_to.older_regex_date": {"lt": age}}})]
+
+
+def not_expired_clause() -> Dict[str, Any]:
+    """Clause matching annotations with no expiry date or one after today. Today is used rather
+    than the current time so the clause stays the same, and cacheable, for the whole day."""
+    today = datetime.datetime.utcnow().date().isoformat()
+    return {"bool": {"should": [{"range": {"metadata.expires": {"gt": today}}},
+                                {"term": {"metadata.has_expiry": False}}],
+                     "minimum_should_match": 1}}
+
+
+def annotation_query(clauses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Query for unexpired annotations matching all the scope clauses. Hits are never ranked, so
+    the query is wrapped in constant_score to skip scoring."""
+    return {"constant_score": {"filter": {"bool": {"filter": clauses + [not_expired_clause()]}}}}
+
+
+@functools.lru_cache(maxsize=None)
+def query_builder(has_ext: bool, has_size: bool, has_regex_date: bool) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Return a function that builds the annotation query for records of a given shape.
+    The choice of clauses only depends on which of ext, size and regex_date the record has, so
+    it is made once per shape and the returned function just fills in the record values."""
+    clause_builders = [(path_clauses, "path")]
+    # if the record has an extention then look for annotations with extention scope.
+    if has_ext:
+        clause_builders.append((ext_clauses, "ext"))
+    # if the record has a size then look for annotations with smaller and larger fields.
+    if has_size:
+        clause_builders.append((size_clauses, "size"))
+    # if the record has a regex date then look for annotations with regex fields.
+    if has_regex_date:
+        clause_builders.append((regex_date_clauses, "regex_date"))
+    clause_builders.append((under_clauses, "path"))
+
+    def build(record: FBIRecord) -> Dict[str, Any]:
+        return annotation_query([clause for builder, field in clause_builders
+                                 for clause in builder(getattr(record, field))])
+    return build
+
+
+def build_query(record: FBIRecord) -> Dict[str, Any]:
+    """Build the annotation query for a given FBI record. 
     This function lookes for annotations that apply to the record's path, extension, size, and regex date.
     The base assumption is that annotations apply globally unless they specify a restriction on scope 
     in the applies_to field. Thus the pattern for this query is
       applies_to.<attibute1> matchs fbi record OR applies_to.<attibute1> does not exist AND 
       applies_to.<attibute2> matchs fbi record OR applies_to.<attibute2> does not exist AND
-      ... and so on."""
-
-    clauses = []
-    now = datetime.datetime.now().isoformat()
-    query = {"bool": {
-                "must": clauses,
-                "must_not": [{"range": {"metadata.expires": {"lte": "2025-03-07"}}}]
-            }}
-    
-    # add exact path clause
-    clauses.append({"bool": {"should": [{"term": {"applies_to.path": record["path"]}}],
-                            "should_not": [{"exists": {"field": "applies_to.path"}}]}})
+      ... and so on.
+    "does not exist" is tested with the applies_to.<attibute>_unset flag added at store time."""
+    build = query_builder(record.ext is not None, record.size is not None, record.regex_date is not None)
+    return build(record)
 
-    # if the record has an extention then look for annotations with extention scope.
-    if record.get("ext") is not None:
-        clauses.append({"bool": {"should": [{"term": {"applies_to.ext": ".nc"}}],
-                                "should_not": [{"exists": {"field": "applies_to.ext"}}]}})
 
-    # if the record has a size then look for annotations with smaller and larger fields.
-    if record.get("size") is not None:
-        clauses.append({"bool": {"should": [{"range": {"applies_to.smaller": {"gte": record["size"]}}}],
-                                 "should_not": [{"exists": {"field": "applies_to.smaller"}}]}})
-        clauses.append({"bool": {"should": [{"range": {"applies_to.larger": {"lte": record["size"]}}}],
-                                 "should_not": [{"exists": {"field": "applies_to.larger"}}]}})        
+def hits_to_annotations(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert a search response into a list of annotations with their ids. The fields that only
+    exist in the index are removed, so they do not count towards the annotation's specificity."""
+    return [{**strip_index_fields(hit["_source"]), "_id": hit["_id"]} for hit in result["hits"]["hits"]]
 
-    # if the record has a regex date then look for annotations with regex fields.
-    if record.get("regex_date") is not None:
-        age = datetime.datetime.now() - datetime.datetime.fromisoformat(record["regex_date"])
-
-        clauses.append({"bool": {"should": [{"range": {"applies_to.before_regex_date": {"gte": record["regex_date"]}}}],
-                                  "should_not": [{"exists": {"field": "applies_to.before_regex_date"}}]}})
-        clauses.append({"bool": {"should": [{"range": {"applies_to.after_regex_date": {"lte": record["regex_date"]}}}],
-                                  "should_not": [{"exists": {"field": "applies_to.after_regex_date"}}]}})
-        clauses.append({"bool": {"should": [{"range": {"applies_to.younger_regex_date": {"lte": age.days}}}],
-                                  "should_not": [{"exists": {"field": "applies_to.younger_regex_date"}}]}})    
-        clauses.append({"bool": {"should": [{"range": {"applies_to.older_regex_date": {"gte": age.days}}}],
-                                  "should_not": [{"exists": {"field": "applies_to.older_regex_date"}}]}})        
-
-    # add causes for applies.under
-    parent_path = record["path"]
-    should_under_terms = []
-    clauses.append({"bool": {"should": should_under_terms,
-                             "should_not": [{"exists": {"field": "applies.under"}}]}})
-    while parent_path != "":
-        should_under_terms.append({"term": {"applies_to.under": parent_path}})
-        parent_path = os.path.dirname(parent_path)
-
-    result = ES.search(index=INDEXNAME, query=query, size=1000)
+
+def search_kwargs(query: Dict[str, Any], source_fields: List[str]) -> Dict[str, Any]:
+    """Arguments for the first page of an annotation search. It can use the request cache and
+    SEARCH_PREFERENCE, so it is answered from the shard caches where possible."""
+    return {"index": INDEXNAME, "query": query, "size": PAGE_SIZE, "_source": source_fields,
+            "track_total_hits": False, "request_cache": True, "preference": SEARCH_PREFERENCE}
+
+
+def pit_search_kwargs(query: Dict[str, Any], source_fields: List[str], pit_id: str,
+                      search_after: Optional[List[Any]]) -> Dict[str, Any]:
+    """Arguments for one page of an annotation search on a point in time. A point in time search
+    can not take an index or a preference, but still asks for the request cache."""
+    return {"query": query, "size": PAGE_SIZE, "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+            "sort": [{"_shard_doc": "asc"}], "search_after": search_after, "_source": source_fields,
+            "track_total_hits": False, "request_cache": True}
+
+
+def search_all(query: Dict[str, Any], source_fields: List[str]) -> Iterator[Dict[str, Any]]:
+    """Yield every annotation matching query. A single search is enough unless it returns a full
+    page, in which case the search starts again on a point in time and pages through with
+    search_after."""
+    es = get_client()
+    result = es.search(**search_kwargs(query, source_fields))
+    if len(result["hits"]["hits"]) < PAGE_SIZE:
+        yield from hits_to_annotations(result)
+        return
+
+    pit_id = es.open_point_in_time(index=INDEXNAME, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        search_after = None
+        while True:
+            result = es.search(**pit_search_kwargs(query, source_fields, pit_id, search_after))
+            pit_id = result.get("pit_id", pit_id)
+            hits = result["hits"]["hits"]
+            yield from hits_to_annotations(result)
+            if len(hits) < PAGE_SIZE:
+                break
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+
+def es_find_fbi_annotations(record: FBIRecord,
+                            source_fields: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Find annotations for a given FBI record.
+    Only the source_fields are returned for each annotation, defaulting to ANNOTATION_SOURCE_FIELDS.
+    There is no limit on the number of annotations and they are yielded as each page arrives."""
+    return search_all(build_query(record), source_fields or ANNOTATION_SOURCE_FIELDS)
+
+
+def es_find_fbi_annotations_bulk(records: List[FBIRecord],
+                                 source_fields: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """Find annotations for many FBI records in one multi-search request.
+    Returns a list of annotation lists in the same order as records. Any record whose search
+    failed, or that has a full page of results, is looked up again with es_find_fbi_annotations."""
+    if not records:
+        return []
+    payload = []
+    for record in records:
+        payload.append({"index": INDEXNAME, "request_cache": True, "preference": SEARCH_PREFERENCE})
+        payload.append({"query": build_query(record), "size": PAGE_SIZE,
+                        "_source": source_fields or ANNOTATION_SOURCE_FIELDS, "track_total_hits": False})
+    result = get_client().msearch(body=payload)
     results = []
-    for hit in result["hits"]["hits"]:
-        hit["_source"]["_id"] = hit["_id"]
-        results.append(hit["_source"])
-        
-    return results 
-
-    
-   
\ No newline at end of file
+    for record, response in zip(records, result["responses"]):
+        if "error" in response:
+            print(f"Error finding annotations for {record.path}, retrying on its own: {response['error']}")
+            results.append(list(es_find_fbi_annotations(record, source_fields)))
+        elif len(response["hits"]["hits"]) < PAGE_SIZE:
+            results.append(hits_to_annotations(response))
+        else:
+            results.append(list(es_find_fbi_annotations(record, source_fields)))
+    return results
+
+
+def build_scope_query(directory: str, ext: Optional[str], bucket: Optional[int]) -> Dict[str, Any]:
+    """Build a query for all annotations that could apply to a file in directory with the given
+    ext and size bucket. This is a superset of the annotations for any one file, which
+    annotation_applies narrows down. Path and under scopes are only fetched for the directory's
+    own entries: under can be the directory, one of its ancestors or the file itself. Regex date
+    scopes are not searched on, as files in a directory rarely share a date."""
+    children = direct_children_regexp(directory)
+    clauses = [scope_clause("path", {"regexp": {"applies_to.path": children}}),
+               scope_clause("under", {"bool": {"should": [
+                   {"terms": {"applies_to.under": ancestor_paths(directory)}},
+                   {"regexp": {"applies_to.under": children}}]}})]
+    if ext is not None:
+        clauses.extend(ext_clauses(ext))
+    if bucket is not None:
+        lowest, highest = size_bucket_bounds(bucket)
+        clauses.append(scope_clause("smaller", {"range": {"applies_to.smaller": {"gt": lowest}}}))
+        clauses.append(scope_clause("larger", {"range": {"applies_to.larger": {"lt": highest}}}))
+    return annotation_query(clauses)
+
+
+@functools.lru_cache(maxsize=100_000)
+def cached_scope_annotations(directory: str, ext: Optional[str], bucket: Optional[int],
+                             window: int) -> Tuple[Dict[str, Any], ...]:
+    """Annotations that could apply to files sharing a directory, ext and size bucket.
+    window is the CACHE_TTL period the lookup was made in, so entries are not reused after it."""
+    query = build_scope_query(directory, ext, bucket)
+    return tuple(search_all(query, ANNOTATION_SOURCE_FIELDS))
+
+
+def es_find_fbi_annotations_cached(record: FBIRecord) -> List[Dict[str, Any]]:
+    """Find annotations for a given FBI record, sharing lookups between files in the same directory
+    with the same ext and size bucket. Lookups are reused for up to CACHE_TTL seconds, so expiry
+    dates and annotations saved by other processes are picked up after that; refresh_cache forgets
+    them straight away."""
+    candidates = cached_scope_annotations(os.path.dirname(record.path), record.ext,
+                                          size_bucket(record.size), int(time.time() // CACHE_TTL))
+    return [annotation for annotation in candidates if annotation_applies(annotation, record)]
+
+
+def refresh_cache() -> None:
+    """Forget cached annotation lookups."""
+    cached_scope_annotations.cache_clear()
+
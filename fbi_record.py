@@ -0,0 +1,63 @@
+"""typed FBI records and the contexts annotations are matched against"""
+
+
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import fbi_core
+
+
+@dataclass(slots=True)
+class FBIRecord:
+    """An FBI record for a file, directory or link."""
+    path: str
+    directory: Optional[str] = None
+    name: Optional[str] = None
+    ext: Optional[str] = None
+    size: Optional[int] = None
+    item_type: Optional[str] = None
+    last_modified: Optional[str] = None
+    regex_date: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> 'FBIRecord':
+        """Make an FBIRecord from an fbi_core record, ignoring any fields not used for annotations."""
+        return cls(**{f.name: record.get(f.name) for f in fields(cls)})
+
+
+@dataclass(slots=True)
+class AnnotationContext:
+    """The item an annotation is being matched against."""
+    path: str
+    size: Optional[int] = None
+    item_type: Optional[str] = None
+    regex_date: Optional[str] = None
+
+    @classmethod
+    def from_record(cls, record: FBIRecord) -> 'AnnotationContext':
+        return cls(path=record.path, size=record.size, item_type=record.item_type, regex_date=record.regex_date)
+
+    def _extract_date(self) -> Optional[datetime]:
+        return datetime.fromisoformat(self.regex_date) if self.regex_date else None
+
+
+def get_raw_record(path: str) -> Dict[str, Any]:
+    """Get the fbi_core record for a path, with all of its fields."""
+    return fbi_core.get_record(path)
+
+
+def get_raw_records(paths: List[str]) -> List[Dict[str, Any]]:
+    """Get the fbi_core records for many paths, in the same order as paths. Uses the fbi_core bulk
+    lookup when it has one so that most records come back in a single request. Its results are
+    matched to paths by each record's path, and any path it did not return is looked up on its
+    own, so a record is never paired with the wrong path."""
+    if not hasattr(fbi_core, "get_records"):
+        return [fbi_core.get_record(path) for path in paths]
+    by_path = {record["path"]: record for record in fbi_core.get_records(paths) if record}
+    return [by_path[path] if path in by_path else fbi_core.get_record(path) for path in paths]
+
+
+def get_record(path: str) -> FBIRecord:
+    """Get the FBI record for a path."""
+    return FBIRecord.from_dict(get_raw_record(path))
@@ -0,0 +1,46 @@
+"""merging the annotations that apply to a record into a single annotation"""
+
+
+from collections import ChainMap
+from typing import Any, Dict
+import functools
+import operator
+
+
+MERGE_STRATEGIES = ("default", "addition", "override")
+
+
+def specificity(annotation: Dict[str, Any]) -> tuple:
+    """Sort key putting the least specific annotations first: an exact path beats under, a deeper
+    under beats a shallower one, and then more scope restrictions beat fewer. The id breaks ties
+    so the merge does not depend on search hit order."""
+    applies_to = annotation.get("applies_to") or {}
+    under = applies_to.get("under")
+    under_depth = len([part for part in under.split("/") if part]) + 1 if under else 0
+    restrictions = sum(1 for value in applies_to.values() if value is not None)
+    return (applies_to.get("path") is not None, under_depth, restrictions, str(annotation.get("_id", "")))
+
+
+def merge_annotations(annotations):
+    """Merge annotations based on their merge strategy.
+    Defaults are applied first, then additions which collect values for the same key into a list,
+    then overrides which replace anything already there. Within a strategy the most specific
+    annotation wins. Annotations with an unknown merge strategy are skipped."""
+    buckets = {strategy: [] for strategy in MERGE_STRATEGIES}
+    for annotation in annotations:
+        strategy = annotation.get("merge_strategy")
+        if strategy not in buckets:
+            print(f"Skipping annotation {annotation.get('_id')} with unknown merge strategy {strategy!r}.")
+            continue
+        buckets[strategy].append(annotation)
+    buckets = {strategy: [a["annotation"] for a in sorted(matched, key=specificity)]
+               for strategy, matched in buckets.items()}
+
+    merged = functools.reduce(operator.or_, buckets["default"], {})
+    for addition in buckets["addition"]:
+        for key, value in addition.items():
+            if key in merged:
+                merged[key] = list(merged[key]) if isinstance(merged[key], list) else [merged[key]]
+            merged.setdefault(key, []).extend(value if isinstance(value, list) else [value])
+    merged.update(ChainMap(*reversed(buckets["override"])))
+    return merged
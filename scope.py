@@ -0,0 +1,127 @@
+"""rules deciding whether an annotation's applies_to scope covers an FBI record
+
+These are the rules the Elasticsearch queries implement, kept free of any Elasticsearch or
+fbi_core imports so that AppliesTo and the client side checks can share them.
+"""
+
+
+from datetime import datetime
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# size limits used to tag annotations with the size buckets they apply to in full, so that most
+# applies_to.smaller checks are a term filter rather than a range.
+SIZE_BUCKETS = [10**3, 10**6, 10**9, 10**12]
+
+
+def ancestor_paths(path: str) -> List[str]:
+    """List a path and all its ancestors, e.g. /data/cmip5/f.nc -> [/data/cmip5/f.nc, /data/cmip5, /data, /]."""
+    parts = path.rstrip("/").split("/")
+    paths = ["/".join(parts[:i]) for i in range(len(parts), 1, -1)]
+    if path.startswith("/"):
+        paths.append("/")
+    else:
+        paths.append(parts[0])
+    return paths
+
+
+def is_under(path: str, under: str) -> bool:
+    """True if path is under, or is, the directory under. Whole path components are compared, so
+    /database is not under /data."""
+    under = under.rstrip("/")
+    return path == under or path.startswith(under + "/") or under == ""
+
+
+def smaller_matches(size: int, smaller: int) -> bool:
+    """applies_to.smaller: the file must be < smaller bytes."""
+    return size < smaller
+
+
+def larger_matches(size: int, larger: int) -> bool:
+    """applies_to.larger: the file must be > larger bytes."""
+    return size > larger
+
+
+def parse_date(value: str) -> datetime:
+    """Parse an ISO format date, as used for regex dates and the applies_to date scopes."""
+    return datetime.fromisoformat(value)
+
+
+def age_in_days(date: str, now: Optional[datetime] = None) -> int:
+    """Whole days since date, as compared with applies_to.younger_regex_date and older_regex_date."""
+    return ((now or datetime.now()) - parse_date(date)).days
+
+
+def before_matches(date: datetime, before: datetime) -> bool:
+    """applies_to.before_regex_date: the date must be < before."""
+    return date < before
+
+
+def after_matches(date: datetime, after: datetime) -> bool:
+    """applies_to.after_regex_date: the date must be > after."""
+    return date > after
+
+
+def younger_matches(age: int, younger: int) -> bool:
+    """applies_to.younger_regex_date: the date must be < younger days old."""
+    return age < younger
+
+
+def older_matches(age: int, older: int) -> bool:
+    """applies_to.older_regex_date: the date must be > older days old."""
+    return age > older
+
+
+def size_bucket(size: Optional[int]) -> Optional[int]:
+    """Logarithmic size bucket used to share cached annotation lookups between files."""
+    return None if size is None else size.bit_length()
+
+
+def size_bucket_bounds(bucket: int) -> Tuple[int, int]:
+    """Smallest and largest size in a size_bucket, inclusive."""
+    lowest = 1 << (bucket - 1) if bucket else 0
+    return lowest, (1 << bucket) - 1
+
+
+def size_bucket_limit(size: int) -> Optional[int]:
+    """The smallest of SIZE_BUCKETS that size is below, or None if it is above them all."""
+    return next((b for b in SIZE_BUCKETS if size < b), None)
+
+
+def size_bucket_matches(smaller: int) -> List[str]:
+    """Tags for the SIZE_BUCKETS in which every size is < smaller."""
+    return [f"lt_{b}" for b in SIZE_BUCKETS if b <= smaller]
+
+
+def direct_children_regexp(directory: str) -> str:
+    """Lucene regexp matching the paths directly inside directory."""
+    prefix = directory.rstrip("/") + "/"
+    return re.sub(r'([.?+*|{}\[\]()"\\#@&<>~])', r"\\\1", prefix) + "[^/]*"
+
+
+def annotation_applies(annotation: Dict[str, Any], record: Any) -> bool:
+    """Check an annotation's path, under, size and regex date scopes against a record with path,
+    size and regex_date attributes. The directory level cached search only matches the path and
+    size scopes approximately, and leaves the regex date scopes to this check."""
+    applies_to = annotation.get("applies_to") or {}
+    if applies_to.get("path") is not None and applies_to["path"] != record.path:
+        return False
+    if applies_to.get("under") is not None and not is_under(record.path, applies_to["under"]):
+        return False
+    if record.size is not None:
+        if applies_to.get("smaller") is not None and not smaller_matches(record.size, applies_to["smaller"]):
+            return False
+        if applies_to.get("larger") is not None and not larger_matches(record.size, applies_to["larger"]):
+            return False
+    if record.regex_date is not None:
+        date = parse_date(record.regex_date)
+        if applies_to.get("before_regex_date") is not None and not before_matches(date, parse_date(applies_to["before_regex_date"])):
+            return False
+        if applies_to.get("after_regex_date") is not None and not after_matches(date, parse_date(applies_to["after_regex_date"])):
+            return False
+        age = age_in_days(record.regex_date)
+        if applies_to.get("younger_regex_date") is not None and not younger_matches(age, applies_to["younger_regex_date"]):
+            return False
+        if applies_to.get("older_regex_date") is not None and not older_matches(age, applies_to["older_regex_date"]):
+            return False
+    return True
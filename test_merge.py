@@ -0,0 +1,63 @@
+import pytest
+
+from merge import merge_annotations, specificity
+
+
+def annotation(strategy, values, _id, **applies_to):
+    return {"_id": _id, "merge_strategy": strategy, "annotation": values, "applies_to": applies_to}
+
+
+def test_strategies_apply_default_then_addition_then_override():
+    merged = merge_annotations([
+        annotation("override", {"a": "override"}, "1"),
+        annotation("addition", {"a": "added", "b": "added"}, "2"),
+        annotation("default", {"a": "default", "c": "default"}, "3"),
+    ])
+    assert merged == {"a": "override", "b": ["added"], "c": "default"}
+
+
+def test_additions_collect_into_lists():
+    merged = merge_annotations([
+        annotation("default", {"tags": "base"}, "1"),
+        annotation("addition", {"tags": ["x", "y"]}, "2"),
+        annotation("addition", {"tags": "z"}, "3"),
+    ])
+    assert merged == {"tags": ["base", "x", "y", "z"]}
+
+
+def test_additions_do_not_change_the_annotations():
+    tags = ["x"]
+    merge_annotations([annotation("addition", {"tags": tags}, "1"), annotation("addition", {"tags": "y"}, "2")])
+    assert tags == ["x"]
+
+
+def test_unknown_strategy_is_skipped(capsys):
+    merged = merge_annotations([
+        annotation("default", {"a": 1}, "1"),
+        annotation("replace", {"a": 2}, "2"),
+        {"_id": "3", "annotation": {"a": 3}},
+    ])
+    assert merged == {"a": 1}
+    assert "unknown merge strategy 'replace'" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("strategy", ["default", "override"])
+def test_most_specific_annotation_wins(strategy):
+    broad = annotation(strategy, {"a": "broad"}, "1", under="/data")
+    deeper = annotation(strategy, {"a": "deeper"}, "2", under="/data/cmip5")
+    exact = annotation(strategy, {"a": "exact"}, "3", path="/data/cmip5/f.nc")
+    for order in ([broad, deeper, exact], [exact, deeper, broad], [deeper, exact, broad]):
+        assert merge_annotations(order) == {"a": "exact"}
+    assert merge_annotations([deeper, broad]) == {"a": "deeper"}
+
+
+def test_specificity_counts_restrictions_then_id():
+    assert specificity(annotation("default", {}, "1", ext=".nc", smaller=1000)) > \
+        specificity(annotation("default", {}, "2", ext=".nc"))
+    assert specificity(annotation("default", {}, "1", smaller=1000)) < \
+        specificity(annotation("default", {}, "2", ext=".nc"))
+
+
+def test_specificity_ignores_unset_values():
+    assert specificity(annotation("default", {}, "1", ext=".nc", smaller=None))[:3] == \
+        specificity(annotation("default", {}, "1", ext=".nc"))[:3]
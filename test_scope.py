@@ -0,0 +1,127 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from scope import (after_matches, age_in_days, ancestor_paths, annotation_applies, before_matches,
+                   direct_children_regexp, is_under, older_matches, parse_date, size_bucket,
+                   size_bucket_bounds, size_bucket_limit, size_bucket_matches, younger_matches)
+
+
+def record(path, size=None, regex_date=None):
+    return SimpleNamespace(path=path, size=size, regex_date=regex_date)
+
+
+def test_ancestor_paths():
+    assert ancestor_paths("/data/cmip5/f.nc") == ["/data/cmip5/f.nc", "/data/cmip5", "/data", "/"]
+    assert ancestor_paths("/data/") == ["/data", "/"]
+    assert ancestor_paths("/") == ["/"]
+    assert ancestor_paths("data/x") == ["data/x", "data"]
+
+
+@pytest.mark.parametrize("path, under, expected", [
+    ("/data/cmip5/f.nc", "/data", True),
+    ("/data/cmip5/f.nc", "/data/", True),
+    ("/data", "/data", True),
+    ("/data/f.nc", "/", True),
+    ("/database/f.nc", "/data", False),
+    ("/other/f.nc", "/data", False),
+])
+def test_is_under(path, under, expected):
+    assert is_under(path, under) is expected
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 999, 1000, 1023, 1024, 10**12])
+def test_size_bucket_bounds_contain_size(size):
+    lowest, highest = size_bucket_bounds(size_bucket(size))
+    assert lowest <= size <= highest
+
+
+def test_size_buckets_do_not_overlap():
+    for bucket in range(1, 50):
+        assert size_bucket_bounds(bucket)[0] == size_bucket_bounds(bucket - 1)[1] + 1
+
+
+def test_size_bucket_none():
+    assert size_bucket(None) is None
+
+
+@pytest.mark.parametrize("size, limit", [(0, 10**3), (999, 10**3), (1000, 10**6), (10**12, None)])
+def test_size_bucket_limit(size, limit):
+    assert size_bucket_limit(size) == limit
+
+
+def test_size_bucket_matches():
+    assert size_bucket_matches(999) == []
+    assert size_bucket_matches(1000) == ["lt_1000"]
+    assert size_bucket_matches(1000000000) == ["lt_1000", "lt_1000000", "lt_1000000000"]
+
+
+@pytest.mark.parametrize("size", [0, 500, 999, 1000, 5000, 10**9 - 1, 10**9, 10**12 + 1])
+@pytest.mark.parametrize("smaller", [1, 500, 1000, 1001, 10**6, 10**9, 10**12, 10**13])
+def test_size_bucket_tag_or_narrow_range_matches_smaller(size, smaller):
+    """The tag term plus the range below the bucket limit find exactly the annotations with
+    smaller > size."""
+    limit = size_bucket_limit(size)
+    tagged = limit is not None and f"lt_{limit}" in size_bucket_matches(smaller)
+    in_range = size < smaller and (limit is None or smaller < limit)
+    assert (tagged or in_range) == (size < smaller)
+
+
+def test_direct_children_regexp_escapes_reserved_characters():
+    assert direct_children_regexp("/data/cmip5") == "/data/cmip5/[^/]*"
+    assert direct_children_regexp("/a.b/c+d/") == r"/a\.b/c\+d/[^/]*"
+    assert direct_children_regexp("/") == "/[^/]*"
+
+
+@pytest.mark.parametrize("applies_to, expected", [
+    ({}, True),
+    ({"path": "/data/cmip5/f.nc"}, True),
+    ({"path": "/data/cmip5/g.nc"}, False),
+    ({"under": "/data"}, True),
+    ({"under": "/data/cmip5/f.nc"}, True),
+    ({"under": "/data/cmip6"}, False),
+    ({"smaller": 1000}, True),
+    ({"smaller": 234}, False),
+    ({"smaller": 100}, False),
+    ({"larger": 100}, True),
+    ({"larger": 234}, False),
+    ({"under": "/data", "smaller": 1000000000}, True),
+])
+def test_annotation_applies(applies_to, expected):
+    assert annotation_applies({"applies_to": applies_to}, record("/data/cmip5/f.nc", 234)) is expected
+
+
+def test_date_scopes_are_strict():
+    day = parse_date("2021-01-01")
+    assert before_matches(parse_date("2020-12-31"), day)
+    assert not before_matches(day, day)
+    assert after_matches(parse_date("2021-01-02"), day)
+    assert not after_matches(day, day)
+    assert younger_matches(9, 10) and not younger_matches(10, 10)
+    assert older_matches(11, 10) and not older_matches(10, 10)
+
+
+def test_age_in_days():
+    assert age_in_days("2021-01-01", now=datetime(2021, 1, 11, 12)) == 10
+
+
+@pytest.mark.parametrize("applies_to, expected", [
+    ({"before_regex_date": "2021-01-02"}, True),
+    ({"before_regex_date": "2021-01-01"}, False),
+    ({"after_regex_date": "2020-12-31"}, True),
+    ({"after_regex_date": "2021-01-01"}, False),
+    ({"older_regex_date": 1}, True),
+    ({"younger_regex_date": 1}, False),
+])
+def test_annotation_applies_regex_dates(applies_to, expected):
+    annotation = {"applies_to": applies_to}
+    assert annotation_applies(annotation, record("/data/f_20210101.nc", 234, "2021-01-01")) is expected
+
+
+def test_annotation_applies_ignores_date_scopes_without_a_regex_date():
+    assert annotation_applies({"applies_to": {"before_regex_date": "2000-01-01"}}, record("/data/f.nc"))
+
+
+def test_annotation_applies_ignores_size_limits_without_a_size():
+    assert annotation_applies({"applies_to": {"smaller": 10, "larger": 20}}, record("/data/f.nc"))